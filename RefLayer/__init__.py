@@ -1,39 +1,51 @@
 import json
+import os
 import random
+import re
+from bisect import bisect_left
 from dataclasses import dataclass, field
 from enum import IntEnum
+from functools import lru_cache
 from pathlib import Path
-from typing import Callable, Dict, List, Optional, Tuple
+from typing import Callable, Dict, FrozenSet, List, Optional, Set, Tuple
 
 import krita as K
 
-@dataclass
-class TransformParams:
-    x0: float
-    y0: float
-    dx: float
-    dy: float
-    s: float
-    w: float
-    h: float
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-    def xml(self) -> str:
-        transform = f"""\
+# Shared by the widgets, the extension and the dock factory registration.
+instance = K.Krita.instance()
+
+def dumpJson(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+def loadJson(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Indentation is only for readability; Krita gets the XML on a single line.
+_XML_TEMPLATE = ''.join(line.strip() for line in """\
         <!DOCTYPE transform_params>
         <transform_params>
         <main id="tooltransformparams"/>
         <data mode="0">
         <free_transform>
-            <transformedCenter type="pointf" x="{self.dx}" y="{self.dy}"/>
-            <originalCenter type="pointf" x="{self.x0}" y="{self.y0}"/>
+            <transformedCenter type="pointf" x="{dx}" y="{dy}"/>
+            <originalCenter type="pointf" x="{x0}" y="{y0}"/>
             <rotationCenterOffset type="pointf" x="0" y="0"/>
             <transformAroundRotationCenter value="0" type="value"/>
             <aX value="0" type="value"/>
             <aY value="0" type="value"/>
             <aZ value="0" type="value"/>
             <cameraPos z="1024" type="vector3d" x="0" y="0"/>
-            <scaleX value="{self.s}" type="value"/>
-            <scaleY value="{self.s}" type="value"/>
+            <scaleX value="{s}" type="value"/>
+            <scaleY value="{s}" type="value"/>
             <shearX value="0" type="value"/>
             <shearY value="0" type="value"/>
             <keepAspectRatio value="0" type="value"/>
@@ -42,8 +54,21 @@ class TransformParams:
         </free_transform>
         </data>
         </transform_params>
-        """
-        return transform
+        """.splitlines())
+
+@dataclass(frozen=True, slots=True)
+class TransformParams:
+    x0: float
+    y0: float
+    dx: float
+    dy: float
+    s: float
+    w: float
+    h: float
+
+    def xml(self) -> str:
+        return _XML_TEMPLATE.format(
+            x0=self.x0, y0=self.y0, dx=self.dx, dy=self.dy, s=self.s)
 
 class Alignment(IntEnum):
     TOP_LEFT = 0
@@ -56,6 +81,25 @@ class Alignment(IntEnum):
     BOTTOM = 7
     BOTTOM_RIGHT = 8
 
+# Horizontal and vertical fractions of the free space before the image,
+# indexed by Alignment.
+_ALIGN_FRAC = tuple((c/2, r/2) for r in range(3) for c in range(3))
+
+@lru_cache(maxsize=256)
+def _computeTransformCore(
+        wc: int, hc: int, wi: int, hi: int,
+        alignment: Alignment,
+        imageScale: float,
+        scaleToFit: bool,
+        ) -> Tuple[float, float, float, float, float]:
+    """Scale, offset within the container, and scaled size of the image."""
+    wi, hi = wi*imageScale, hi*imageScale
+    s = min(wc/wi, hc/hi, 1.0) if scaleToFit else 1.0
+    fx, fy = _ALIGN_FRAC[alignment]
+    ox = (wc - wi*s)*fx
+    oy = (hc - hi*s)*fy
+    return s*imageScale, ox, oy, wi*s, hi*s
+
 def computeTransform(
         container: K.QRect,
         img: K.QRect,
@@ -63,14 +107,17 @@ def computeTransform(
         imageScale: float = 1.0,
         scaleToFit: bool = True,
         ) -> TransformParams:
-    wc, hc = container.width(), container.height()
-    wi, hi = img.width()*imageScale, img.height()*imageScale
-    s = min(wc/wi, hc/hi, 1.0) if scaleToFit else 1.0
-    x0 = img.x()
-    y0 = img.y()
-    dx = container.x() + (wc - wi*s)*(alignment % 3)/2
-    dy = container.y() + (hc - hi*s)*(alignment // 3)/2
-    return TransformParams(x0, y0, dx, dy, s*imageScale, wi*s, hi*s)
+    s, ox, oy, w, h = _computeTransformCore(
+        container.width(), container.height(), img.width(), img.height(),
+        alignment, imageScale, scaleToFit)
+    dx = container.x() + ox
+    dy = container.y() + oy
+    return TransformParams(img.x(), img.y(), dx, dy, s, w, h)
+
+@lru_cache(maxsize=None)
+def getIcon(name: str) -> K.QIcon:
+    """Krita icon, loaded once and shared by all widgets."""
+    return instance.icon(name)
 
 class LabelNumberUnit(K.QWidget):
     def __init__(self, label: str, units: List[str], includeLock: bool = False) -> None:
@@ -93,20 +140,18 @@ class LabelNumberUnit(K.QWidget):
         if includeLock:
             self.isLocked = False
             self.lock = K.QPushButton()
-            self.lock.setIcon(K.Krita.instance().icon('unlocked'))
+            self.lock.setIcon(getIcon('unlocked'))
             self.lock.setSizePolicy(K.QSizePolicy.Fixed, K.QSizePolicy.Fixed)
             self.lock.clicked.connect(self._toggleLock)
             layout.addWidget(self.lock)
 
     def _toggleLock(self):
         self.isLocked = not self.isLocked
-        inst = K.Krita.instance()
-        self.lock.setIcon(inst.icon('locked' if self.isLocked else 'unlocked'))
+        self.lock.setIcon(getIcon('locked' if self.isLocked else 'unlocked'))
 
     def setValue(self, v: int) -> None:
-        self.number.blockSignals(True)
-        self.number.setValue(v)
-        self.number.blockSignals(False)
+        with K.QSignalBlocker(self.number):
+            self.number.setValue(v)
 
 def matchWidths(widgets: List[K.QWidget]) -> None:
     """Find max width and set all widths to it."""
@@ -116,7 +161,7 @@ def matchWidths(widgets: List[K.QWidget]) -> None:
     for widget in widgets:
         widget.setFixedWidth(width)
 
-@dataclass
+@dataclass(slots=True)
 class Margins:
     left: int = 0
     right: int = 0
@@ -132,14 +177,55 @@ class Margins:
         }
         return obj
 
+# Formats decoded without an alpha channel. The node bounds of such an image
+# are the full image rect, so its transform is known before decoding.
+_opaqueFormats = (
+    K.QImage.Format_RGB32,
+    K.QImage.Format_RGB888,
+    K.QImage.Format_Grayscale8,
+)
+
+def getOpaqueImageSize(path: Path) -> Optional[K.QSize]:
+    """Read the size of an opaque image from its header without decoding."""
+    reader = K.QImageReader(str(path))
+    size = reader.size()
+    if not size.isValid() or reader.imageFormat() not in _opaqueFormats:
+        return None
+    return size
+
+# Shared by all layers. Kept small since reference images can be huge.
+@lru_cache(maxsize=8)
+def _loadImageCached(path: str, mtime: int, w: int, h: int) -> K.QImage:
+    reader = K.QImageReader(path)
+    if w > 0 and h > 0:
+        # Decoders like libjpeg can decode directly at a reduced size.
+        reader.setScaledSize(K.QSize(w, h))
+    return reader.read()
+
+def loadImage(path: Path, w: int = 0, h: int = 0) -> K.QImage:
+    """Load an image, reusing the decoded image if the file is unchanged.
+
+    The image is decoded at w x h if both are given.
+    """
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return K.QImage(str(path))
+    return _loadImageCached(str(path), mtime, w, h)
+
 def loadImageToNode(image: K.QImage, node: K.Node) -> None:
-    # The format is hardcoded. Maybe condition on it later.
-    image = image.convertToFormat(K.QImage.Format_ARGB32)
+    # RGB32 has the same memory layout as ARGB32 with opaque alpha.
+    if image.format() != K.QImage.Format_RGB32:
+        image = image.convertToFormat(K.QImage.Format_ARGB32)
     w = image.width()
     h = image.height()
     size = 4*w*h
     imageData = image.constBits().asstring(size)
-    node.setPixelData(imageData, 0, 0, w, h)
+    # Wrap the bytes without a second copy into a QByteArray. imageData must
+    # stay alive until setPixelData returns. The asstring() copy is the one
+    # copy left; removing it needs native code linked against Krita, which a
+    # pure-Python plugin zip can't ship.
+    node.setPixelData(K.QByteArray.fromRawData(imageData), 0, 0, w, h)
 
 def clearNode(node: K.Node) -> None:
     rect = node.bounds()
@@ -149,39 +235,80 @@ def clearNode(node: K.Node) -> None:
     node.setPixelData(bytes(size), rect.x(), rect.y(), w, h)
     node.move(0, 0)
 
-validImageExt = set(
-    '.' + fmt.data().decode('utf-8')
+validImageExt: FrozenSet[str] = frozenset(
+    '.' + fmt.data().decode('ascii')
     for fmt in K.QImageReader.supportedImageFormats()
-)
-validImageExt.discard('.kra')
+) - {'.kra'}
+
+imageNameFilter = f'Images ({" ".join("*" + ext for ext in sorted(validImageExt))})'
+
+# Sorted directory listings keyed by directory, along with the directory
+# mtime each listing was built from.
+_pathsCache: Dict[Path, Tuple[int, List[Path]]] = {}
+# Directories under a file system watch. Their listings are dropped from
+# _pathsCache when they change, so they need no mtime check.
+_watchedDirs: Set[Path] = set()
 
 def getImagePaths(pathDir: Path) -> List[Path]:
-    paths = [
-        path for path in pathDir.iterdir()
-        if path.suffix in validImageExt
-    ]
-    return paths
-
-def getNextPath(path: Path) -> Path:
-    paths = getImagePaths(path.parent)
-    i = paths.index(path)
-    p = paths[(i+1) % len(paths)]
-    return p
-
-def getPrevPath(path: Path) -> Path:
-    paths = getImagePaths(path.parent)
-    i = paths.index(path)
-    p = paths[(i-1) % len(paths)]
-    return p
-
-def getRandPath(path: Path) -> Path:
-    paths = getImagePaths(path.parent)
-    i = paths.index(path)
-    j = random.randrange(1, len(paths))
-    p = paths[(i+j) % len(paths)]
-    return p
-
-@dataclass
+    entry = _pathsCache.get(pathDir)
+    if entry is not None and pathDir in _watchedDirs:
+        return entry[1]
+    mtime = pathDir.stat().st_mtime_ns
+    if entry is None or entry[0] != mtime:
+        paths = []
+        with os.scandir(pathDir) as it:
+            for dirEntry in it:
+                name = dirEntry.name
+                dot = name.rfind('.')
+                if dot > 0 and name[dot:].lower() in validImageExt:
+                    paths.append(Path(dirEntry.path))
+        paths.sort()
+        entry = (mtime, paths)
+        _pathsCache[pathDir] = entry
+    return entry[1]
+
+class PathCycler:
+    """Steps through the images in a path's directory.
+
+    The listing and current index are kept, so stepping needs no directory
+    scan or index lookup.
+    """
+    __slots__ = ('path', '_paths', '_index')
+
+    def __init__(self, path: Path) -> None:
+        self._paths = getImagePaths(path.parent)
+        if not self._paths:
+            raise ValueError(f'No images in {path.parent}')
+        # The listing is sorted, so locate the path by binary search. A path
+        # that was removed is placed at its successor.
+        self._index = bisect_left(self._paths, path) % len(self._paths)
+        self.path = path
+
+    def isStale(self) -> bool:
+        """Whether the directory listing was rebuilt since this cycler was made."""
+        return getImagePaths(self.path.parent) is not self._paths
+
+    def _step(self, j: int) -> Path:
+        if j > 0 and self._paths[self._index] != self.path:
+            # The current path was removed, so the index is already past it.
+            j -= 1
+        self._index = (self._index + j) % len(self._paths)
+        self.path = self._paths[self._index]
+        return self.path
+
+    def next(self) -> Path:
+        return self._step(1)
+
+    def prev(self) -> Path:
+        return self._step(-1)
+
+    def rand(self) -> Path:
+        """Step to a random image other than the current one."""
+        if len(self._paths) < 2:
+            return self.path
+        return self._step(random.randrange(1, len(self._paths)))
+
+@dataclass(slots=True)
 class LayerState:
     doc: K.Document
     node: K.Node
@@ -191,9 +318,13 @@ class LayerState:
     scale: float = 1.0
     scaleToFit: bool = True
     currentScale: float = 1.0
+    _prevPath: Optional[Path] = field(default=None, init=False, repr=False, compare=False)
+    _prevBounds: Optional[K.QRect] = field(default=None, init=False, repr=False, compare=False)
+    _cycler: Optional[PathCycler] = field(default=None, init=False, repr=False, compare=False)
+    _containerKey: Optional[Tuple[int, ...]] = field(default=None, init=False, repr=False, compare=False)
+    _container: Optional[K.QRect] = field(default=None, init=False, repr=False, compare=False)
 
     def __post_init__(self) -> None:
-        self._prevPath = None
         self._prevBounds = self.doc.bounds()
 
     def toJson(self) -> dict:
@@ -228,31 +359,63 @@ class LayerState:
         if self.path == self._prevPath:
             t = self._getTransform(self._prevBounds)
             if t.s == self.currentScale:
-                self.node.move(int(t.dx-t.x0), int(t.dy-t.y0))
-                self.doc.refreshProjection()
+                pos = K.QPoint(int(t.dx-t.x0), int(t.dy-t.y0))
+                # Recompositing the canvas is expensive, so skip it if the
+                # node is already in place.
+                if self.node.position() != pos:
+                    self.node.move(pos.x(), pos.y())
+                    self.doc.refreshProjection()
                 return
-        image = K.QImage(str(self.path))
-        # node = self.doc.createNode(self.node.name(), 'paintlayer')
         node = self.node
+        decode = self._getDecodeTransform()
+        if decode:
+            bounds, transform = decode
+            image = loadImage(self.path, int(transform.w), int(transform.h))
+        else:
+            image = loadImage(self.path)
+        # node = self.doc.createNode(self.node.name(), 'paintlayer')
         clearNode(node)
         loadImageToNode(image, node)
-        bounds = K.QRect(node.bounds())
-        transform = self._getTransform(bounds)
-        self._applyTransform(node, transform)
+        if decode:
+            # Already decoded at its display size, so only move it.
+            t = transform
+            node.move(int(t.dx-t.x0), int(t.dy-t.y0))
+            self.currentScale = t.s
+        else:
+            bounds = K.QRect(node.bounds())
+            transform = self._getTransform(bounds)
+            self._applyTransform(node, transform)
         self.node.setAlphaLocked(True)
         self.doc.refreshProjection()
         self._prevPath = self.path
         self._prevBounds = bounds
 
+    def _getDecodeTransform(self) -> Optional[Tuple[K.QRect, TransformParams]]:
+        """Return the bounds and transform if the image can be decoded scaled down."""
+        size = getOpaqueImageSize(self.path)
+        if size is None:
+            return None
+        bounds = K.QRect(K.QPoint(0, 0), size)
+        t = self._getTransform(bounds)
+        if 0 < int(t.w) < size.width() and 0 < int(t.h) < size.height():
+            return bounds, t
+        return None
+
     def _getTransform(self, bounds: K.QRect) -> TransformParams:
         docRect = self.doc.bounds()
-        container = K.QRect(
-            docRect.x() + self.margins.left,
-            docRect.y() + self.margins.top,
-            docRect.width() - self.margins.left - self.margins.right,
-            docRect.height() - self.margins.top - self.margins.bottom)
+        m = self.margins
+        key = (docRect.x(), docRect.y(), docRect.width(), docRect.height(),
+               m.left, m.right, m.top, m.bottom)
+        # Only build a new QRect when the document or margins changed.
+        if key != self._containerKey:
+            self._containerKey = key
+            self._container = K.QRect(
+                docRect.x() + m.left,
+                docRect.y() + m.top,
+                docRect.width() - m.left - m.right,
+                docRect.height() - m.top - m.bottom)
         transform = computeTransform(
-            container=container,
+            container=self._container,
             img=bounds,
             alignment=self.alignment,
             imageScale=self.scale,
@@ -279,6 +442,23 @@ class LayerState:
         # self.node = node
         self.currentScale = t.s
 
+    def _getCycler(self) -> PathCycler:
+        # Rebuild if the path was set elsewhere, e.g. from the file dialog, or
+        # if files were added or removed since the listing was taken.
+        cycler = self._cycler
+        if cycler is None or cycler.path != self.path or cycler.isStale():
+            self._cycler = PathCycler(self.path)
+        return self._cycler
+
+    def nextPath(self) -> Path:
+        return self._getCycler().next()
+
+    def prevPath(self) -> Path:
+        return self._getCycler().prev()
+
+    def randPath(self) -> Path:
+        return self._getCycler().rand()
+
     def index(self) -> Tuple:
         root = self.doc.rootNode()
         indices = []
@@ -303,13 +483,23 @@ class DynamicComboBox(K.QComboBox):
 class CanvasCoordinates:
     """Workaround for getting canvas coordinates."""
     def __init__(self) -> None:
-        self._instance = K.Krita.instance()
+        self._instance = instance
+        self._canvasWindow: Optional[K.QMainWindow] = None
+        self._canvasWidgets: List[K.QOpenGLWidget] = []
+
+    def invalidate(self) -> None:
+        """Drop cached canvas widgets. Call when views are added or removed."""
+        self._canvasWindow = None
+        self._canvasWidgets = []
 
     def _getCanvasWidgets(self) -> List[K.QOpenGLWidget]:
         window = self._instance.activeWindow()
         if window is None:
             return []
         qwindow = window.qwindow()
+        # Searching the widget tree is slow, so reuse the last result.
+        if qwindow is self._canvasWindow:
+            return self._canvasWidgets
         pattern = K.QRegExp('^view_.*')
         viewWidgets = qwindow.findChildren(K.QWidget, pattern)
         canvasWidgets = []
@@ -317,6 +507,8 @@ class CanvasCoordinates:
             obj = viewWidget.findChild(K.QOpenGLWidget)
             if obj:
                 canvasWidgets.append(obj)
+        self._canvasWindow = qwindow
+        self._canvasWidgets = canvasWidgets
         return canvasWidgets
 
     def _getActiveCanvasWidget(self) -> Optional[K.QOpenGLWidget]:
@@ -345,13 +537,23 @@ class CanvasCoordinates:
 
 State = Tuple[List[LayerState], Optional[LayerState]]
 
+_TRAILING_DIGITS = re.compile(r'(\d+)$')
+
 class RefLayerWidget(K.QWidget):
     def __init__(self) -> None:
         super().__init__()
         # State
         self._state: Dict[str, State] = {}
+        self._pendingState: Optional[State] = None
+        self._pendingRefresh: Dict[str, K.Document] = {}
+        self._updateTimer = K.QTimer()
+        self._stateDirty: Set[str] = set()
+        # Last annotation bytes written to or read from each document.
+        self._persistedData: Dict[str, bytes] = {}
+        self._persistTimer = K.QTimer()
+        self._fsWatcher = K.QFileSystemWatcher(self)
         # Krita state
-        self._instance = K.Krita.instance()
+        self._instance = instance
         self._notifier = self._instance.notifier()
         self._window = None
         self._coords = CanvasCoordinates()
@@ -368,6 +570,7 @@ class RefLayerWidget(K.QWidget):
         self._visibleButton = K.QPushButton()
         self._copyButton = K.QPushButton()
         self._alignmentButtons = [K.QCheckBox() for _ in range(9)]
+        self._alignmentGroup = K.QButtonGroup(self)
         self._marginFromLayerButton = K.QPushButton('Margins from Active Layer.')
         self._marginInputs = [
             LabelNumberUnit(label, ['px'])
@@ -377,17 +580,19 @@ class RefLayerWidget(K.QWidget):
         self._scaleTextInput = LabelNumberUnit('Image Scale:', ['%'])
         self._scaleToFitCheckBox = K.QCheckBox('Scale image down to fit.')
         self._scaleText = K.QLabel('Current Image Scale: 100%')
+        self._tabWidget = K.QTabWidget()
+        self._tabConfigs: Dict[int, Callable[[], None]] = {}
         # Configuration
         self._configureNotifier()
+        self._configureTimers()
+        self._configureWatcher()
         self._configureLayout()
         self._configureCombo()
         self._configureFileSelection()
         self._configureNavigation()
         self._configureVisible()
         self._configureCopy()
-        self._configureAlignment()
-        self._configureMargin()
-        self._configureScale()
+        self._configureTabs()
         self._configureExtension()
 
     def _getActiveState(self) -> Optional[State]:
@@ -398,7 +603,8 @@ class RefLayerWidget(K.QWidget):
             layers = []
             if 'RefLayer' in doc.annotationTypes():
                 data = doc.annotation('RefLayer').data()
-                for obj in json.loads(data):
+                self._persistedData[doc.name()] = data
+                for obj in loadJson(data):
                     layer = LayerState.fromJson(obj, doc)
                     if layer:
                         layers.append(layer)
@@ -416,19 +622,23 @@ class RefLayerWidget(K.QWidget):
         docNames = set(doc.name() for doc in self._instance.documents())
         for docName in (self._state.keys() - docNames):
             del self._state[docName]
+            self._persistedData.pop(docName, None)
         # Remove orphaned nodes and sort layers.
         state = self._getActiveState()
         if state is None:
             return
         layers, activeLayer = state
+        # Query each node's parent once; identity checks reuse the result.
         layers = [
             layer for layer in layers
             if layer.node.parentNode() is not None
         ]
-        layers.sort(key=lambda x: x.index(), reverse=True)
-        if activeLayer is None or activeLayer.node.parentNode() is None:
+        if len(layers) > 1:
+            layers.sort(key=LayerState.index, reverse=True)
+        if activeLayer is None or all(layer is not activeLayer for layer in layers):
             activeLayer = layers[0] if layers else None
         self._setActiveState((layers, activeLayer))
+        self._releaseWatches()
 
     def _getLayerNames(self) -> List[str]:
         # Routinely cleanup orphaned nodes. Maybe there is a signal for this?
@@ -439,17 +649,51 @@ class RefLayerWidget(K.QWidget):
         return [layer.node.name() for layer in state[0]]
 
     def _updateState(self, state: State, updateUI: bool = True) -> None:
+        self._applyState(state, updateUI)
+        activeLayer = state[1]
+        if activeLayer:
+            # Debounced updates can land after the view changed, so mark the
+            # document that owns the state rather than the active one.
+            # Persisting serializes every layer, so defer it until idle.
+            self._stateDirty.add(activeLayer.doc.name())
+            self._persistTimer.start()
+
+    def _applyState(self, state: State, updateUI: bool = True) -> None:
         layers, activeLayer = state
         if activeLayer:
             activeLayer.update()
             if updateUI:
                 text = f'Current Image Scale: {activeLayer.currentScale*100:.3g}%'
                 self._scaleText.setText(text)
-        doc = self._instance.activeDocument()
-        if doc:
-            obj = [layer.toJson() for layer in layers]
-            data = json.dumps(obj).encode('utf-8')
-            doc.setAnnotation('RefLayer', 'RefLayer Metadata', data)
+
+    def _persistState(self) -> None:
+        if not self._stateDirty:
+            return
+        docs = {doc.name(): doc for doc in self._instance.documents()}
+        for docName in self._stateDirty:
+            doc = docs.get(docName)
+            state = self._state.get(docName)
+            if doc and state:
+                obj = [layer.toJson() for layer in state[0]]
+                data = dumpJson(obj)
+                if self._persistedData.get(docName) != data:
+                    doc.setAnnotation('RefLayer', 'RefLayer Metadata', data)
+                    self._persistedData[docName] = data
+        self._stateDirty.clear()
+
+    def _scheduleUpdateState(self, state: State) -> None:
+        # Coalesce bursts of edits into a single update.
+        self._pendingState = state
+        self._updateTimer.start()
+
+    def _flushPendingUpdate(self) -> None:
+        state = self._pendingState
+        self._pendingState = None
+        if state:
+            self._updateState(state)
+        for doc in self._pendingRefresh.values():
+            doc.refreshProjection()
+        self._pendingRefresh.clear()
 
     def _updateStateUI(self, state: State) -> None:
         layerNames = self._getLayerNames()
@@ -461,10 +705,9 @@ class RefLayerWidget(K.QWidget):
             self._fileText.setText(str(activeLayer.path))
             self._fileDialog.setDirectory(str(activeLayer.path.parent))
             isVisible = activeLayer.node.visible()
-            icon = self._instance.icon('visible' if isVisible else 'novisible')
+            icon = getIcon('visible' if isVisible else 'novisible')
             self._visibleButton.setIcon(icon)
-            for i, button in enumerate(self._alignmentButtons):
-                button.setChecked(i == activeLayer.alignment)
+            self._alignmentButtons[activeLayer.alignment].setChecked(True)
             m = activeLayer.margins
             for lnu, v in zip(self._marginInputs, [m.left, m.right, m.top, m.bottom]):
                 lnu.setValue(v)
@@ -477,6 +720,10 @@ class RefLayerWidget(K.QWidget):
             self._scaleText.setText(text)
 
     def _handleActiveViewChanged(self) -> None:
+        self._updateTimer.stop()
+        self._flushPendingUpdate()
+        self._persistState()
+        self._coords.invalidate()
         state = self._getActiveState()
         if state:
             self._updateStateUI(state)
@@ -487,6 +734,52 @@ class RefLayerWidget(K.QWidget):
 
     def _configureNotifier(self) -> None:
         self._notifier.windowCreated.connect(self._handleWindowCreated)
+        self._notifier.applicationClosing.connect(self._persistState)
+        self._notifier.viewCreated.connect(self._coords.invalidate)
+        self._notifier.viewClosed.connect(self._coords.invalidate)
+
+    def _configureTimers(self) -> None:
+        self._updateTimer.setSingleShot(True)
+        self._updateTimer.setInterval(50)
+        self._updateTimer.timeout.connect(self._flushPendingUpdate)
+        self._persistTimer.setSingleShot(True)
+        self._persistTimer.setInterval(1000)
+        self._persistTimer.timeout.connect(self._persistState)
+
+    def _handleDirectoryChanged(self, directory: str) -> None:
+        # Files were added, removed or renamed. Dropping the listing makes
+        # the layers' cyclers stale.
+        pathDir = Path(directory)
+        _pathsCache.pop(pathDir, None)
+        # Qt stops watching a directory that was removed.
+        if directory not in self._fsWatcher.directories():
+            _watchedDirs.discard(pathDir)
+
+    def _watchDirectory(self, pathDir: Path) -> None:
+        # Stay well below the OS limit on watches. Unwatched directories
+        # fall back to the mtime check in getImagePaths.
+        if pathDir in _watchedDirs or len(_watchedDirs) >= 64:
+            return
+        if self._fsWatcher.addPath(str(pathDir)):
+            # Drop any listing made before the watch started.
+            _pathsCache.pop(pathDir, None)
+            _watchedDirs.add(pathDir)
+
+    def _releaseWatches(self) -> None:
+        # Unwatch directories that no layer points into any more, so they
+        # are not held open (and locked on Windows) for the whole session.
+        used = {
+            layer.path.parent
+            for layers, _ in self._state.values()
+            for layer in layers
+        }
+        unused = _watchedDirs - used
+        if unused:
+            self._fsWatcher.removePaths([str(d) for d in unused])
+            _watchedDirs.difference_update(unused)
+
+    def _configureWatcher(self) -> None:
+        self._fsWatcher.directoryChanged.connect(self._handleDirectoryChanged)
 
     def _configureLayout(self) -> None:
         mainLayout = K.QVBoxLayout()
@@ -509,10 +802,10 @@ class RefLayerWidget(K.QWidget):
         comboLayout.addWidget(self._addLayerButton)
         comboLayout.addWidget(self._comboBox)
         comboLayout.addWidget(self._deleteLayerButton)
-        self._addLayerButton.setIcon(self._instance.icon('addlayer'))
+        self._addLayerButton.setIcon(getIcon('addlayer'))
         self._addLayerButton.setSizePolicy(K.QSizePolicy.Fixed, K.QSizePolicy.Fixed)
         self._addLayerButton.setToolTip('Add new RefLayer.')
-        self._deleteLayerButton.setIcon(self._instance.icon('deletelayer'))
+        self._deleteLayerButton.setIcon(getIcon('deletelayer'))
         self._deleteLayerButton.setSizePolicy(K.QSizePolicy.Fixed, K.QSizePolicy.Fixed)
         self._deleteLayerButton.setToolTip('Delete RefLayer.')
         mainLayout.addWidget(comboWidget)
@@ -524,7 +817,7 @@ class RefLayerWidget(K.QWidget):
         fileLayout.addWidget(self._fileButton)
         fileLayout.addWidget(self._fileText)
         self._fileText.setReadOnly(True)
-        self._fileButton.setIcon(self._instance.icon('folder'))
+        self._fileButton.setIcon(getIcon('folder'))
         self._fileButton.setToolTip('Change path.')
         mainLayout.addWidget(fileWidget)
 
@@ -537,18 +830,18 @@ class RefLayerWidget(K.QWidget):
         navLayout.addWidget(self._prevButton)
         navLayout.addWidget(self._nextButton)
         navLayout.addWidget(self._randButton)
-        self._visibleButton.setIcon(self._instance.icon('visible'))
+        self._visibleButton.setIcon(getIcon('visible'))
         self._visibleButton.setSizePolicy(K.QSizePolicy.Fixed, K.QSizePolicy.Fixed)
         self._visibleButton.setToolTip('Toggle visibility.')
-        self._copyButton.setIcon(self._instance.icon('cloneLayer'))
+        self._copyButton.setIcon(getIcon('cloneLayer'))
         self._copyButton.setSizePolicy(K.QSizePolicy.Fixed, K.QSizePolicy.Fixed)
         self._copyButton.setToolTip('Copy full-sized image to clipboard.')
-        self._randButton.setIcon(self._instance.icon('view-refresh'))
+        self._randButton.setIcon(getIcon('view-refresh'))
         self._randButton.setSizePolicy(K.QSizePolicy.Fixed, K.QSizePolicy.Fixed)
         self._randButton.setToolTip('Random image.')
         mainLayout.addWidget(navWidget)
 
-        tabWidget = K.QTabWidget()
+        tabWidget = self._tabWidget
         mainLayout.addWidget(tabWidget)
 
         alignLayout = K.QVBoxLayout()
@@ -562,8 +855,10 @@ class RefLayerWidget(K.QWidget):
         for i, button in enumerate(self._alignmentButtons):
             gridLayout.addWidget(button, i // 3, i % 3)
             button.setToolTip(Alignment(i).name)
+            self._alignmentGroup.addButton(button, i)
         alignLayout.addWidget(gridWidget)
-        tabWidget.addTab(alignWidget, 'Alignment')
+        i = tabWidget.addTab(alignWidget, 'Alignment')
+        self._tabConfigs[i] = self._configureAlignment
 
         marginLayout = K.QVBoxLayout()
         marginLayout.setAlignment(K.Qt.AlignTop)
@@ -576,7 +871,8 @@ class RefLayerWidget(K.QWidget):
         marginLayout.addWidget(self._containerWidth)
         marginLayout.addWidget(self._containerHeight)
         matchWidths([self._containerWidth.label, self._containerHeight.label])
-        tabWidget.addTab(marginWidget, 'Margins')
+        i = tabWidget.addTab(marginWidget, 'Margins')
+        self._tabConfigs[i] = self._configureMargin
 
         scaleLayout = K.QVBoxLayout()
         scaleLayout.setAlignment(K.Qt.AlignTop)
@@ -585,7 +881,8 @@ class RefLayerWidget(K.QWidget):
         scaleLayout.addWidget(self._scaleTextInput)
         scaleLayout.addWidget(self._scaleToFitCheckBox)
         scaleLayout.addWidget(self._scaleText)
-        tabWidget.addTab(scaleWidget, 'Scale')
+        i = tabWidget.addTab(scaleWidget, 'Scale')
+        self._tabConfigs[i] = self._configureScale
 
     def _handleIndexChanged(self, index: int) -> None:
         state = self._getActiveState()
@@ -602,13 +899,9 @@ class RefLayerWidget(K.QWidget):
         # Some extra work to avoid duplicate names.
         maxNum = 0
         for layer in layers:
-            name = layer.node.name()
-            i = len(name) - 1
-            num = 0
-            while name[i].isdigit() and i >= 0:
-                i -= 1
-            if i + 1 < len(name):
-                maxNum = max(maxNum, int(name[i+1:]))
+            m = _TRAILING_DIGITS.search(layer.node.name())
+            if m:
+                maxNum = max(maxNum, int(m.group(1)))
         return f'##RefLayer {maxNum+1}'
 
     def _handleAddLayer(self) -> None:
@@ -635,6 +928,7 @@ class RefLayerWidget(K.QWidget):
             layers, activeLayer = state
             activeLayer.node.remove()
             layers.remove(activeLayer)
+            self._releaseWatches()
             if layers:
                 state = (layers, layers[0])
                 self._setActiveState(state)
@@ -651,13 +945,13 @@ class RefLayerWidget(K.QWidget):
             files = self._fileDialog.selectedFiles()
             path = Path(files[0])
             state[1].path = path
+            self._releaseWatches()
             self._fileDialog.setDirectory(str(path.parent))
             self._fileText.setText(str(path))
             self._updateState(state)
 
     def _configureFileSelection(self) -> None:
-        ext = ' '.join(map(lambda s: '*' + s, validImageExt))
-        self._fileDialog.setNameFilter(f'Images ({ext})')
+        self._fileDialog.setNameFilter(imageNameFilter)
         self._fileButton.clicked.connect(self._handleFileButtonClick)
 
     def _chooseLayer(self, layers: List[LayerState]) -> Optional[LayerState]:
@@ -674,7 +968,7 @@ class RefLayerWidget(K.QWidget):
                     return layer
         return None
 
-    def _handlePathSuccessor(self, getPath: Callable[[Path], Path]) -> None:
+    def _handlePathSuccessor(self, getPath: Callable[[LayerState], Path]) -> None:
         state = self._getActiveState()
         if state:
             layers, activeLayer = state
@@ -682,20 +976,21 @@ class RefLayerWidget(K.QWidget):
             updateUI = chosenLayer == activeLayer
             if chosenLayer is None:
                 return
-            path = getPath(chosenLayer.path)
+            path = getPath(chosenLayer)
             chosenLayer.path = path
+            self._watchDirectory(path.parent)
             if updateUI:
                 self._fileText.setText(str(path))
             self._updateState((layers, chosenLayer), updateUI=updateUI)
 
     def _handleNextButtonClick(self) -> None:
-        self._handlePathSuccessor(getNextPath)
+        self._handlePathSuccessor(LayerState.nextPath)
 
     def _handlePrevButtonClick(self) -> None:
-        self._handlePathSuccessor(getPrevPath)
+        self._handlePathSuccessor(LayerState.prevPath)
 
     def _handleRandButtonClick(self) -> None:
-        self._handlePathSuccessor(getRandPath)
+        self._handlePathSuccessor(LayerState.randPath)
 
     def _configureNavigation(self) -> None:
         self._nextButton.clicked.connect(self._handleNextButtonClick)
@@ -712,9 +1007,12 @@ class RefLayerWidget(K.QWidget):
             isVisible = not chosenLayer.node.visible()
             chosenLayer.node.setVisible(isVisible)
             if chosenLayer == activeLayer:
-                icon = self._instance.icon('visible' if isVisible else 'novisible')
+                icon = getIcon('visible' if isVisible else 'novisible')
                 self._visibleButton.setIcon(icon)
-            chosenLayer.doc.refreshProjection()
+            # Rapid toggles from the keyboard shortcut share one refresh.
+            doc = chosenLayer.doc
+            self._pendingRefresh[doc.name()] = doc
+            self._updateTimer.start()
 
     def _configureVisible(self) -> None:
         self._visibleButton.clicked.connect(self._handleVisibleButtonClick)
@@ -728,30 +1026,32 @@ class RefLayerWidget(K.QWidget):
     def _configureCopy(self) -> None:
         self._copyButton.clicked.connect(self._handleCopyButtonClick)
 
-    def _handleAlignmentButtonClick(self, a: Alignment) -> Callable[[], None]:
-        def _handle() -> None:
-            for i, button in enumerate(self._alignmentButtons):
-                button.setChecked(i == a)
-            state = self._getActiveState()
-            if state and state[1]:
-                state[1].alignment = a
-                self._updateState(state)
-        return _handle
+    def _handleAlignmentButtonClick(self, i: int) -> None:
+        # The exclusive button group has already updated the check states.
+        a = Alignment(i)
+        state = self._getActiveState()
+        if state and state[1] and state[1].alignment != a:
+            state[1].alignment = a
+            self._scheduleUpdateState(state)
 
     def _configureAlignment(self) -> None:
-        for i, button in enumerate(self._alignmentButtons):
-            button.setChecked(i == Alignment.CENTER)
-            button.clicked.connect(self._handleAlignmentButtonClick(Alignment(i)))
+        self._alignmentGroup.idClicked.connect(self._handleAlignmentButtonClick)
 
     def _handleTransformChange(self) -> None:
         state = self._getActiveState()
         if state and state[1]:
-            attrs = ['left', 'right', 'top', 'bottom']
-            for m, attr in zip(self._marginInputs, attrs):
-                setattr(state[1].margins, attr, m.number.value())
-            state[1].scale = self._scaleTextInput.number.value() / 100
-            state[1].scaleToFit = self._scaleToFitCheckBox.isChecked()
-            self._updateState(state)
+            layer = state[1]
+            margins = Margins(*(get() for get in self._marginGetters))
+            scale = self._scaleGetter() / 100
+            scaleToFit = self._scaleToFitGetter()
+            # editingFinished and returnPressed both fire on Enter, and focus
+            # changes fire editingFinished without an edit.
+            if (margins, scale, scaleToFit) == (layer.margins, layer.scale, layer.scaleToFit):
+                return
+            layer.margins = margins
+            layer.scale = scale
+            layer.scaleToFit = scaleToFit
+            self._scheduleUpdateState(state)
 
     def _handleEdgeChange(
             self,
@@ -815,9 +1115,6 @@ class RefLayerWidget(K.QWidget):
 
     def _configureMargin(self) -> None:
         self._marginFromLayerButton.clicked.connect(self._handleMarginFromLayer)
-        for widget in self._marginInputs:
-            widget.number.setRange(-10000, 10000)
-            widget.number.setValue(0)
         for widget in (self._marginInputs + [self._containerWidth, self._containerHeight]):
             line = widget.number.lineEdit()
             line.editingFinished.connect(self._handleTransformChange)
@@ -840,8 +1137,6 @@ class RefLayerWidget(K.QWidget):
         for widget, handle in zip(self._marginInputs, edgeHandles):
             widget.number.valueChanged.connect(handle)
 
-        self._containerWidth.number.setRange(0, 50000)
-        self._containerHeight.number.setRange(0, 50000)
         centerHandles = [
             self._handleCenterChange(mis[0], mis[1], self._containerWidth, _getDocWidth),
             self._handleCenterChange(mis[2], mis[3], self._containerHeight, _getDocHeight),
@@ -850,14 +1145,35 @@ class RefLayerWidget(K.QWidget):
         self._containerHeight.number.valueChanged.connect(centerHandles[1])
 
     def _configureScale(self) -> None:
-        self._scaleTextInput.number.setRange(1, 1000)
-        self._scaleTextInput.number.setValue(100)
         line = self._scaleTextInput.number.lineEdit()
         line.editingFinished.connect(self._handleTransformChange)
         line.returnPressed.connect(self._handleTransformChange)
-        self._scaleToFitCheckBox.setChecked(True)
         self._scaleToFitCheckBox.clicked.connect(self._handleTransformChange)
 
+    def _handleTabChanged(self, index: int) -> None:
+        configure = self._tabConfigs.pop(index, None)
+        if configure:
+            configure()
+
+    def _configureTabs(self) -> None:
+        # Defaults and ranges are read by handlers on every tab, so set them
+        # now. Each tab's signals are connected when it is first shown.
+        self._alignmentButtons[Alignment.CENTER].setChecked(True)
+        for widget in self._marginInputs:
+            widget.number.setRange(-10000, 10000)
+            widget.number.setValue(0)
+        self._containerWidth.number.setRange(0, 50000)
+        self._containerHeight.number.setRange(0, 50000)
+        self._scaleTextInput.number.setRange(1, 1000)
+        self._scaleTextInput.number.setValue(100)
+        self._scaleToFitCheckBox.setChecked(True)
+        # Bound getters for _handleTransformChange, which reads every input.
+        self._marginGetters = tuple(w.number.value for w in self._marginInputs)
+        self._scaleGetter = self._scaleTextInput.number.value
+        self._scaleToFitGetter = self._scaleToFitCheckBox.isChecked
+        self._tabWidget.currentChanged.connect(self._handleTabChanged)
+        self._handleTabChanged(self._tabWidget.currentIndex())
+
     def _configureExtension(self) -> None:
         ext = RefLayerExt(self._instance, self)
         self._instance.addExtension(ext)
@@ -899,5 +1215,4 @@ factory = K.DockWidgetFactory(
     'RefLayer',
     K.DockWidgetFactoryBase.DockRight,
     RefLayer)
-instance = K.Krita.instance()
 instance.addDockWidgetFactory(factory)
@@ -1,5 +1,6 @@
+import sys
 from pathlib import Path
-from zipfile import ZipFile
+from zipfile import ZIP_DEFLATED, ZipFile
 
 script_path = Path(__file__).resolve().parent
 
@@ -8,18 +9,20 @@ local_paths = [
     f'{name}.desktop',
     f'{name}/',
 ]
+skip_names = frozenset({'__pycache__', '.git', '.mypy_cache'})
+verbose = '--verbose' in sys.argv[1:]
 
-def recursiveWrite(f: ZipFile, path: Path):
-    if path.name in ['__pycache__']:
-        return
+def iterPaths(root: Path):
+    yield root
+    if root.is_dir():
+        yield from sorted(root.rglob('*'))
 
-    name = path.relative_to(script_path)
-    print(path, '-->', name)
-    f.write(filename=path, arcname=name)
-    if path.is_dir():
-        for p in path.iterdir():
-            recursiveWrite(f, p)
-
-with ZipFile(script_path / f'{name}.zip', 'w') as f:
-    for path in local_paths:
-        recursiveWrite(f, script_path / path)
+with ZipFile(script_path / f'{name}.zip', 'w', ZIP_DEFLATED, compresslevel=6) as f:
+    for local_path in local_paths:
+        for path in iterPaths(script_path / local_path):
+            arcname = path.relative_to(script_path)
+            if not skip_names.isdisjoint(arcname.parts):
+                continue
+            if verbose:
+                print(path, '-->', arcname)
+            f.write(filename=path, arcname=arcname)